@@ -1,6 +1,9 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_from_directory, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from celery import Celery
+from celery.signals import task_postrun
+import redis
 import os
 from flask_cors import CORS
 import re
@@ -9,7 +12,17 @@ from google.cloud import translate_v2 as translate
 import logging
 import gc
 import ssl
+import socket
+import json
+import hashlib
+import functools
+import mimetypes
+import html
+from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pymysql
+from upstream import Upstream, UpstreamError, CircuitOpenError, backoff_delay, raise_for_retryable_status, metrics_snapshot, render_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,8 +50,95 @@ if REDIS_URL.startswith('rediss://'):
         'ssl_cert_reqs': ssl.CERT_NONE
     }
 
+# Celery workers keep their own upstream breakers and counters; each publishes
+# a snapshot here after every task so /metrics on the web process can export them
+metrics_redis = redis.Redis.from_url(
+    REDIS_URL,
+    **({'ssl_cert_reqs': ssl.CERT_NONE} if REDIS_URL.startswith('rediss://') else {})
+)
+UPSTREAM_METRICS_PREFIX = 'upstream_metrics:'
+UPSTREAM_METRICS_TTL = int(os.environ.get('UPSTREAM_METRICS_TTL', 600))
+
+def process_label(role: str) -> str:
+    return f"{role}:{socket.gethostname()}:{os.getpid()}"
+
 # Translation API configuration
-translate_client = translate.Client()
+TRANSLATE_TIMEOUT = float(os.environ.get('TRANSLATE_TIMEOUT', 10))
+
+def make_translate_client(timeout: float = TRANSLATE_TIMEOUT):
+    client = translate.Client()
+    # The v2 client never passes a timeout of its own, so bind one to its
+    # connection; otherwise a hung backend holds the calling thread indefinitely
+    client._connection.api_request = functools.partial(client._connection.api_request, timeout=timeout)
+    return client
+
+translate_client = make_translate_client()
+
+# Upstream call configuration (per-dependency timeouts, retries and hedging)
+lyrics_upstream = Upstream(
+    'lyrics',
+    timeout=float(os.environ.get('LYRICS_TIMEOUT', 5)),
+    max_retries=int(os.environ.get('LYRICS_MAX_RETRIES', 1)),
+    hedge=os.environ.get('LYRICS_HEDGE', '1') == '1'
+)
+translate_upstream = Upstream(
+    'translate',
+    timeout=TRANSLATE_TIMEOUT,
+    max_retries=int(os.environ.get('TRANSLATE_MAX_RETRIES', 1)),
+    hedge=os.environ.get('TRANSLATE_HEDGE', '0') == '1'
+)
+# /proxy fetches arbitrary URLs, so it gets a timeout but no shared circuit
+# breaker: one failing host must not short-circuit requests to every other
+PROXY_TIMEOUT = float(os.environ.get('PROXY_TIMEOUT', 5))
+CONTEXT_RETRY_BACKOFF_BASE = float(os.environ.get('CONTEXT_RETRY_BACKOFF_BASE', 10))
+CONTEXT_RETRY_BACKOFF_CAP = float(os.environ.get('CONTEXT_RETRY_BACKOFF_CAP', 300))
+
+# Track analysis pipeline configuration (per-stage concurrency limits)
+LYRICS_API_URL = 'https://api.lyrics.ovh/v1'
+ANALYZE_MAX_TRACKS = int(os.environ.get('ANALYZE_MAX_TRACKS', 50))
+LYRICS_FETCH_CONCURRENCY = int(os.environ.get('LYRICS_FETCH_CONCURRENCY', 8))
+DETECT_LANGUAGE_CONCURRENCY = int(os.environ.get('DETECT_LANGUAGE_CONCURRENCY', 4))
+MATCH_WORDS_CONCURRENCY = int(os.environ.get('MATCH_WORDS_CONCURRENCY', 4))
+ANALYZE_PIPELINE_WORKERS = int(os.environ.get('ANALYZE_PIPELINE_WORKERS', 16))
+
+# One pool per process for all analyze-tracks requests, so concurrent requests
+# queue for threads instead of each starting its own
+pipeline_executor = ThreadPoolExecutor(max_workers=ANALYZE_PIPELINE_WORKERS, thread_name_prefix='analyze')
+
+lyrics_fetch_slots = threading.BoundedSemaphore(LYRICS_FETCH_CONCURRENCY)
+detect_language_slots = threading.BoundedSemaphore(DETECT_LANGUAGE_CONCURRENCY)
+match_words_slots = threading.BoundedSemaphore(MATCH_WORDS_CONCURRENCY)
+
+# Stored track analyses are reused until the vocabulary version changes, which
+# is only needed when words are added or removed: translations are read from
+# the vocabulary table at serving time. Tracks with no lyrics found are retried
+# once the TTL has passed.
+VOCABULARY_VERSION = os.environ.get('VOCABULARY_VERSION', '1')
+MAX_CONTEXT_LINES = int(os.environ.get('MAX_CONTEXT_LINES', 3))
+MISSING_LYRICS_TTL = timedelta(hours=int(os.environ.get('MISSING_LYRICS_TTL_HOURS', 24)))
+
+# Fingerprinted static assets built by build_static.py
+ASSET_DIST_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_MAX_AGE = 31536000  # one year; hashed names change whenever the content does
+
+def load_asset_manifest() -> dict:
+    try:
+        with open(os.path.join(ASSET_DIST_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning("No asset manifest found; serving unhashed static files")
+        return {}
+
+asset_manifest = load_asset_manifest()
+
+@app.context_processor
+def inject_asset_url():
+    def asset_url(filename: str) -> str:
+        hashed = asset_manifest.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=hashed)
+    return {'asset_url': asset_url}
 
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
@@ -54,24 +154,66 @@ class CommonFrenchWord(db.Model):
     frequency_book = db.Column(db.Float)
     frequency_avg = db.Column(db.Float)
 
+class TrackAnalysis(db.Model):
+    __tablename__ = 'track_analyses'
+    id = db.Column(db.Integer, primary_key=True)
+    track_key = db.Column(db.String(255), unique=True, nullable=False)
+    artist = db.Column(db.String(255))
+    title = db.Column(db.String(255))
+    lyrics = db.Column(db.Text)
+    language = db.Column(db.String(16))
+    confidence = db.Column(db.Float)
+    words = db.Column(db.JSON)
+    contexts = db.Column(db.JSON)
+    vocabulary_version = db.Column(db.String(64), nullable=False)
+    analyzed_at = db.Column(db.DateTime, nullable=False)
+
+class LyricLineTranslation(db.Model):
+    __tablename__ = 'lyric_line_translations'
+    id = db.Column(db.Integer, primary_key=True)
+    line_hash = db.Column(db.String(40), unique=True, nullable=False)
+    line = db.Column(db.Text, nullable=False)
+    translation = db.Column(db.Text, nullable=False)
+
+with app.app_context():
+    for model in (TrackAnalysis, LyricLineTranslation):
+        try:
+            model.__table__.create(db.engine, checkfirst=True)
+        except Exception as e:
+            logger.error(f"Could not create {model.__tablename__} table: {str(e)}", exc_info=True)
+
 @celery.task(bind=True, max_retries=3)
-def generate_context_task(self, lyric):
+def generate_context_task(self, lyric, track_key=None):
     try:
-        return process_context_generation(lyric)
+        context = process_context_generation(lyric)
+        if track_key:
+            save_track_context(track_key, lyric, context)
+        return context
+    except CircuitOpenError as e:
+        # Don't add to the load while the breaker is open; come back once it may close
+        logger.warning(f"Task {self.request.id} deferred: {str(e)}")
+        self.retry(exc=e, countdown=e.retry_after + backoff_delay(0, CONTEXT_RETRY_BACKOFF_BASE, CONTEXT_RETRY_BACKOFF_CAP))
     except Exception as e:
-        logger.error(f"Task {self.request.id} failed: {str(e)}", exc_info=True)
-        self.retry(exc=e, countdown=60)
+        if not translate_upstream.is_retryable(e):
+            # e.g. a 400 from the API or a bug: retrying can't help
+            logger.error(f"Task {self.request.id} failed: {str(e)}", exc_info=True)
+            raise
+        logger.warning(f"Task {self.request.id} will retry: {str(e)}")
+        self.retry(exc=e, countdown=backoff_delay(self.request.retries, CONTEXT_RETRY_BACKOFF_BASE, CONTEXT_RETRY_BACKOFF_CAP))
 
 def process_context_generation(lyric: str) -> str:
     try:
         logger.info(f"Starting context generation for lyric: {lyric}")
         
         # Detect language (optional, as we know it's French)
-        detection = translate_client.detect_language(lyric)
+        # Single attempts: generate_context_task is the only retry layer here,
+        # so one lyric can't multiply into task retries times call retries
+        detection = translate_upstream.call_once(translate_client.detect_language, lyric)
         source_language = detection['language']
         
         # Translate to English
-        translation = translate_client.translate(
+        translation = translate_upstream.call_once(
+            translate_client.translate,
             lyric,
             target_language='en',
             source_language=source_language
@@ -80,15 +222,324 @@ def process_context_generation(lyric: str) -> str:
         translated_text = translation['translatedText']
 
         # Decode HTML entities in the translated text
-        import html
         translated_text = html.unescape(translated_text)
 
         logger.info("Translation completed successfully")
-        return f'This word is used in the lyric, "{lyric}", which translates to "{translated_text}" in English.'
+        return format_context(lyric, translated_text)
     except Exception as e:
         logger.error(f"Error in translation: {str(e)}", exc_info=True)
         raise
 
+def format_context(lyric: str, translated_text: str) -> str:
+    return f'This word is used in the lyric, "{lyric}", which translates to "{translated_text}" in English.'
+
+def lyric_line_hash(line: str) -> str:
+    return hashlib.sha1(line.strip().encode('utf-8')).hexdigest()
+
+def find_line_translation(lyric: str):
+    """Look up a translation precomputed by the pretranslate job."""
+    try:
+        row = LyricLineTranslation.query.filter_by(line_hash=lyric_line_hash(lyric)).first()
+        return row.translation if row else None
+    except Exception as e:
+        logger.error(f"Error looking up line translation: {str(e)}", exc_info=True)
+        return None
+
+def detect_text_language(text: str) -> dict:
+    detection = translate_upstream.call(translate_client.detect_language, text)
+    return {
+        'language': detection['language'],
+        'confidence': detection['confidence']
+    }
+
+def tokenize(text: str) -> list:
+    return re.findall(r'\w+', text.lower())
+
+def lyric_lines(lyrics: str) -> list:
+    return lyrics.split('\n')
+
+def build_line_index(lyrics: str) -> dict:
+    """Map each token to the IDs (positions) of the lyric lines containing it."""
+    index = {}
+    for line_id, line in enumerate(lyric_lines(lyrics)):
+        for token in set(tokenize(line)):
+            index.setdefault(token, []).append(line_id)
+    return index
+
+def best_context_lines(line_ids: list, lines: list) -> list:
+    # Prefer lines with the most words around the match, skipping repeats of
+    # the same line (e.g. a chorus), and keep song order for ties.
+    unique = {}
+    for line_id in line_ids:
+        unique.setdefault(lines[line_id].strip().lower(), line_id)
+    ranked = sorted(unique.values(), key=lambda line_id: (-len(tokenize(lines[line_id])), line_id))
+    return ranked[:MAX_CONTEXT_LINES]
+
+def find_matching_words(lyrics: str) -> list:
+    index = build_line_index(lyrics)
+    lines = lyric_lines(lyrics)
+    matching_words = db.session.query(CommonFrenchWord.id, CommonFrenchWord.word, CommonFrenchWord.translation).filter(
+        CommonFrenchWord.word.in_(index.keys())
+    ).order_by(CommonFrenchWord.word)
+
+    return [
+        {"id": word_id, "word": word, "translation": translation, "lines": best_context_lines(index.get(word.lower(), []), lines)}
+        for word_id, word, translation in matching_words
+    ]
+
+def load_translations(word_ids: set) -> dict:
+    """Current translations for stored words, which only keep vocabulary IDs."""
+    if not word_ids:
+        return {}
+    return dict(db.session.query(CommonFrenchWord.id, CommonFrenchWord.translation).filter(
+        CommonFrenchWord.id.in_(word_ids)
+    ))
+
+def resolve_lyric_line(track_key: str, line_id: int):
+    analysis = TrackAnalysis.query.filter_by(track_key=track_key).first()
+    if analysis is None or not analysis.lyrics:
+        return None
+    lines = lyric_lines(analysis.lyrics)
+    if not 0 <= line_id < len(lines):
+        return None
+    return lines[line_id].strip() or None
+
+def fetch_lyrics(artist: str, title: str):
+    url = f"{LYRICS_API_URL}/{requests.utils.quote(artist, safe='')}/{requests.utils.quote(title, safe='')}"
+    response = lyrics_upstream.call(
+        lambda: raise_for_retryable_status(requests.get(url, timeout=lyrics_upstream.timeout))
+    )
+    if response.status_code != 200:
+        return None
+    return response.json().get('lyrics')
+
+def normalize_track_field(value: str) -> str:
+    return ' '.join(value.split()).lower()
+
+def make_track_key(artist: str, title: str) -> str:
+    # Keyed on exactly what the lyrics are fetched with, so a client can't
+    # attach one song's lyrics to another song's entry. Hashed rather than
+    # truncated so long artist/title pairs can't collide.
+    normalized = f"{normalize_track_field(artist)}\x1f{normalize_track_field(title)}"
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def is_analysis_fresh(analysis: TrackAnalysis) -> bool:
+    if analysis.vocabulary_version != VOCABULARY_VERSION:
+        return False
+    # Analyses stored before words carried vocabulary and context line IDs
+    if any('id' not in word or 'lines' not in word for word in analysis.words or []):
+        return False
+    if not analysis.lyrics:
+        return datetime.utcnow() - analysis.analyzed_at < MISSING_LYRICS_TTL
+    # Lyrics were stored but language detection or word matching failed
+    return analysis.language is not None
+
+def stored_analysis_result(index: int, analysis: TrackAnalysis) -> dict:
+    return {
+        'index': index,
+        'track_key': analysis.track_key,
+        'artist': analysis.artist,
+        'title': analysis.title,
+        'lyrics': analysis.lyrics,
+        'language': analysis.language or 'unknown',
+        'confidence': analysis.confidence or 0,
+        'words': analysis.words or [],
+        'contexts': analysis.contexts or {}
+    }
+
+def serialize_analysis(result: dict) -> str:
+    """Encode a result for the client, which gets line IDs instead of the full lyrics."""
+    lyrics = result['lyrics']
+    contexts = result['contexts'] or {}
+    line_contexts = {}
+    if lyrics and contexts:
+        for line_id, line in enumerate(lyric_lines(lyrics)):
+            if line.strip() in contexts:
+                line_contexts[str(line_id)] = contexts[line.strip()]
+    public = {key: value for key, value in result.items() if key not in ('lyrics', 'contexts')}
+    public['has_lyrics'] = bool(lyrics)
+    public['contexts'] = line_contexts
+    return json.dumps(public) + '\n'
+
+def write_track_analysis(result: dict, complete: bool):
+    analysis = TrackAnalysis.query.filter_by(track_key=result['track_key']).first()
+    if analysis is None:
+        analysis = TrackAnalysis(track_key=result['track_key'], contexts={})
+        db.session.add(analysis)
+    elif analysis.lyrics != result['lyrics']:
+        analysis.contexts = {}
+    analysis.artist = result['artist'][:255]
+    analysis.title = result['title'][:255]
+    analysis.lyrics = result['lyrics']
+    analysis.language = result['language'] if complete else None
+    analysis.confidence = result['confidence']
+    # Translations are joined in when serving so vocabulary updates show up
+    analysis.words = [
+        {'id': word['id'], 'word': word['word'], 'lines': word['lines']}
+        for word in result['words']
+    ]
+    analysis.vocabulary_version = VOCABULARY_VERSION
+    analysis.analyzed_at = datetime.utcnow()
+    db.session.commit()
+    result['contexts'] = analysis.contexts or {}
+
+def save_track_analysis(result: dict, complete: bool = True) -> bool:
+    """Store a result; incomplete ones are saved without a language so they count as stale."""
+    try:
+        try:
+            write_track_analysis(result, complete)
+        except IntegrityError:
+            # Another request inserted the same new track first; update its row instead
+            db.session.rollback()
+            write_track_analysis(result, complete)
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error saving analysis for {result['track_key']}: {str(e)}", exc_info=True)
+        return False
+
+def save_track_context(track_key: str, lyric: str, context: str):
+    with app.app_context():
+        try:
+            # Lock the row so concurrent workers don't overwrite each other's contexts
+            analysis = TrackAnalysis.query.filter_by(track_key=track_key).with_for_update().first()
+            if analysis is None or not analysis.lyrics:
+                db.session.rollback()
+                return
+            if lyric not in {line.strip() for line in lyric_lines(analysis.lyrics)}:
+                db.session.rollback()
+                logger.warning(f"Not saving context for {track_key}: lyric is not a line of the stored lyrics")
+                return
+            # Reassign rather than mutate so the JSON column is marked dirty
+            analysis.contexts = {**(analysis.contexts or {}), lyric: context}
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving context for {track_key}: {str(e)}", exc_info=True)
+
+def analyze_track(index: int, track_key: str, artist: str, title: str) -> dict:
+    """Run the lyrics -> language -> word match stages for a single track.
+
+    Each stage holds its own semaphore slot, so a slow stage only queues work
+    for that stage while the other stages keep going for other tracks.
+    """
+    result = {
+        'index': index,
+        'track_key': track_key,
+        'artist': artist,
+        'title': title,
+        'lyrics': None,
+        'language': 'unknown',
+        'confidence': 0,
+        'words': [],
+        'contexts': {}
+    }
+
+    try:
+        with lyrics_fetch_slots:
+            lyrics = fetch_lyrics(artist, title)
+    except Exception as e:
+        # Not stored, so the next visit tries again
+        logger.error(f"Error fetching lyrics for {artist} - {title}: {str(e)}", exc_info=True)
+        result['error'] = 'Lyrics service unavailable'
+        return result
+    if not lyrics:
+        with app.app_context():
+            save_track_analysis(result)
+        return result
+    result['lyrics'] = lyrics
+
+    complete = True
+    try:
+        with detect_language_slots:
+            result.update(detect_text_language(lyrics))
+    except Exception as e:
+        complete = False
+        logger.error(f"Error detecting language for {artist} - {title}: {str(e)}", exc_info=True)
+
+    with app.app_context():
+        try:
+            with match_words_slots:
+                result['words'] = find_matching_words(lyrics)
+        except Exception as e:
+            complete = False
+            logger.error(f"Error matching words for {artist} - {title}: {str(e)}", exc_info=True)
+
+        # Lyrics are stored even when a later stage failed, so the line IDs sent
+        # to the client stay resolvable; the entry is marked stale for next time
+        if not save_track_analysis(result, complete):
+            result['words'] = [{**word, 'lines': []} for word in result['words']]
+
+    return result
+
+@app.route('/api/analyze-tracks', methods=['POST'])
+def analyze_tracks():
+    tracks = (request.json or {}).get('tracks')
+    if not tracks or not isinstance(tracks, list):
+        return jsonify({'error': 'Tracks are required'}), 400
+    tracks = [track for track in tracks if isinstance(track, dict)][:ANALYZE_MAX_TRACKS]
+    if not tracks:
+        return jsonify({'error': 'Tracks are required'}), 400
+
+    tracks = [
+        {'artist': str(track.get('artist') or ''), 'title': str(track.get('title') or '')}
+        for track in tracks
+    ]
+    track_keys = [make_track_key(track['artist'], track['title']) for track in tracks]
+    try:
+        stored = {
+            analysis.track_key: analysis
+            for analysis in TrackAnalysis.query.filter(TrackAnalysis.track_key.in_(set(track_keys)))
+        }
+    except Exception as e:
+        logger.error(f"Error loading stored analyses: {str(e)}", exc_info=True)
+        stored = {}
+
+    cached_results = []
+    # Tracks to analyze, keyed so a song played more than once runs through the pipeline once
+    pending = {}
+    for index, (track, track_key) in enumerate(zip(tracks, track_keys)):
+        analysis = stored.get(track_key)
+        if analysis is not None and is_analysis_fresh(analysis):
+            cached_results.append(stored_analysis_result(index, analysis))
+        elif track_key in pending:
+            pending[track_key]['indexes'].append(index)
+        else:
+            pending[track_key] = {'track': track, 'indexes': [index]}
+
+    try:
+        translations = load_translations({word['id'] for result in cached_results for word in result['words']})
+    except Exception as e:
+        logger.error(f"Error loading word translations: {str(e)}", exc_info=True)
+        translations = {}
+    for result in cached_results:
+        result['words'] = [{**word, 'translation': translations.get(word['id'])} for word in result['words']]
+    db.session.close()
+
+    def generate():
+        # Results are streamed as newline-delimited JSON in completion order;
+        # each carries its original index so the client can place it.
+        for result in cached_results:
+            yield serialize_analysis(result)
+        if not pending:
+            return
+
+        futures = {
+            pipeline_executor.submit(analyze_track, entry['indexes'][0], track_key, entry['track']['artist'], entry['track']['title']): entry['indexes']
+            for track_key, entry in pending.items()
+        }
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                for index in futures[future]:
+                    yield serialize_analysis({**result, 'index': index})
+        finally:
+            # Drop queued tracks that haven't started if the client went away
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/detect-language', methods=['POST'])
 def detect_language():
     try:
@@ -96,12 +547,11 @@ def detect_language():
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         
-        detection = translate_client.detect_language(text)
-        return jsonify({
-            'language': detection['language'],
-            'confidence': detection['confidence']
-        })
+        return jsonify(detect_text_language(text))
     
+    except UpstreamError as e:
+        logger.error(f"Translation service unavailable: {str(e)}")
+        return jsonify({'error': 'Language detection unavailable'}), 503
     except Exception as e:
         logger.error(f"Error in language detection: {str(e)}", exc_info=True)
         return jsonify({'error': 'Language detection failed'}), 500
@@ -110,12 +560,65 @@ def detect_language():
 def proxy():
     url = request.args.get('url')
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=PROXY_TIMEOUT)
         return jsonify(response.json()), response.status_code
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Upstream error in proxy: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error in proxy: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@task_postrun.connect
+def publish_worker_metrics(**kwargs):
+    # Keyed by pid: a worker recycled by worker_max_tasks_per_child starts new
+    # series from zero (rate() treats that as a counter reset) and the old
+    # process's key expires after UPSTREAM_METRICS_TTL
+    try:
+        metrics_redis.setex(
+            f"{UPSTREAM_METRICS_PREFIX}{process_label('worker')}",
+            UPSTREAM_METRICS_TTL,
+            json.dumps(metrics_snapshot())
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish worker metrics: {str(e)}")
+
+def worker_metrics() -> dict:
+    processes = {}
+    try:
+        for key in metrics_redis.scan_iter(match=f"{UPSTREAM_METRICS_PREFIX}*"):
+            value = metrics_redis.get(key)
+            if value is not None:
+                processes[key.decode()[len(UPSTREAM_METRICS_PREFIX):]] = json.loads(value)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read worker metrics: {str(e)}")
+    return processes
+
+@app.route('/metrics')
+def metrics():
+    processes = worker_metrics()
+    processes[process_label('web')] = metrics_snapshot()
+    return Response(render_metrics(processes), mimetype='text/plain; version=0.0.4')
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    # Serve the best precompressed variant the client accepts
+    accepted = request.accept_encodings
+    served = filename
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[candidate] and os.path.isfile(os.path.join(ASSET_DIST_DIR, filename + suffix)):
+            served, encoding = filename + suffix, candidate
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(ASSET_DIST_DIR, served, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -127,13 +630,18 @@ def match_words():
         if not lyrics:
             return jsonify({'error': 'Lyrics are required'}), 400
 
-        words = set(re.findall(r'\w+', lyrics.lower()))
-        matching_words = db.session.query(CommonFrenchWord.word, CommonFrenchWord.translation).filter(
-            CommonFrenchWord.word.in_(words)
-        ).order_by(CommonFrenchWord.word)
-
-        result = [{"word": word, "translation": translation} for word, translation in matching_words]
-        return jsonify(result)
+        # There is no stored song to resolve line IDs against here, so return
+        # the line text to send to /api/generate-context as 'lyric' instead
+        lines = lyric_lines(lyrics)
+        return jsonify([
+            {
+                'id': word['id'],
+                'word': word['word'],
+                'translation': word['translation'],
+                'context_lines': [lines[line_id].strip() for line_id in word['lines']]
+            }
+            for word in find_matching_words(lyrics)
+        ])
     except Exception as e:
         logger.error(f"Error in match_words: {str(e)}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
@@ -144,10 +652,27 @@ def match_words():
 def generate_context():
     try:
         lyric = request.json.get('lyric')
+        track_key = request.json.get('track_key')
+        line_id = request.json.get('line_id')
+        if not lyric and track_key and isinstance(line_id, int):
+            # Resolve a song/line reference against the stored lyrics
+            lyric = resolve_lyric_line(track_key, line_id)
+            if not lyric:
+                return jsonify({'error': 'Lyric line not found'}), 404
+        else:
+            # Only contexts for lines resolved from the store are saved back to it
+            track_key = None
         if not lyric:
             return jsonify({'error': 'Lyric is required'}), 400
+
+        translated_text = find_line_translation(lyric)
+        if translated_text:
+            context = format_context(lyric, translated_text)
+            if track_key:
+                save_track_context(track_key, lyric, context)
+            return jsonify({'status': 'completed', 'context': context})
         
-        task = generate_context_task.delay(lyric)
+        task = generate_context_task.delay(lyric, track_key)
         return jsonify({'task_id': task.id}), 202
     except translate.exceptions.GoogleAPIError as e:
         logger.error(f"Google Translate API error: {str(e)}", exc_info=True)
@@ -0,0 +1,74 @@
+"""Build fingerprinted, precompressed copies of the files under static/.
+
+Each asset is copied to static/dist/ with a content hash in its name (e.g.
+main.js -> main.3f2a9c1b.js) along with .gz and .br variants for text
+types. static/dist/manifest.json maps the original names to the hashed ones;
+templates resolve them through asset_url() and app.py serves them from
+/assets/ with year-long immutable caching.
+
+    python build_static.py
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('build_static')
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Already-compressed formats like PNG gain nothing from another pass
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.html', '.svg', '.json', '.txt', '.map'}
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+def write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def build_asset(source_path: str, relative_path: str) -> str:
+    with open(source_path, 'rb') as f:
+        data = f.read()
+
+    root, ext = os.path.splitext(relative_path)
+    hashed_path = f"{root}.{fingerprint(data)}{ext}"
+    target_path = os.path.join(DIST_DIR, hashed_path)
+    write_file(target_path, data)
+
+    if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+        write_file(f"{target_path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            write_file(f"{target_path}.br", brotli.compress(data, quality=11))
+
+    return hashed_path.replace(os.sep, '/')
+
+def build():
+    if brotli is None:
+        logger.warning("brotli is not installed; only gzip variants will be built")
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(STATIC_DIR):
+        subdirectories[:] = [d for d in subdirectories if os.path.join(directory, d) != DIST_DIR]
+        for filename in sorted(filenames):
+            source_path = os.path.join(directory, filename)
+            relative_path = os.path.relpath(source_path, STATIC_DIR)
+            manifest[relative_path.replace(os.sep, '/')] = build_asset(source_path, relative_path)
+
+    write_file(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    logger.info(f"Built {len(manifest)} assets into {DIST_DIR}")
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,152 @@
+"""Offline batch job that precomputes translations for serving.
+
+Fills CommonFrenchWord.translation where it is missing, then translates the
+most common lines across the stored track lyrics into LyricLineTranslation so
+/api/generate-context can answer without waiting on the translate API.
+
+Word progress is checkpointed to a JSON file after every committed batch and
+lyric lines already in the table are skipped, so an interrupted run picks up
+where it left off:
+
+    python pretranslate.py --workers 4 --batch-size 100 --top-lines 5000
+"""
+import argparse
+import html
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from app import app, db, CommonFrenchWord, TrackAnalysis, LyricLineTranslation, lyric_line_hash, make_translate_client
+
+logger = logging.getLogger('pretranslate')
+
+# The v2 translate API accepts at most 128 strings per request
+MAX_BATCH_SIZE = 128
+
+worker_client = None
+
+def init_worker():
+    # Each process needs its own client; one inherited across fork is not safe to share
+    global worker_client
+    worker_client = make_translate_client()
+
+def translate_batch(texts: list, source_language: str) -> list:
+    results = worker_client.translate(texts, target_language='en', source_language=source_language)
+    return [html.unescape(result['translatedText']) for result in results]
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_word_id': 0}
+
+def save_checkpoint(path: str, checkpoint: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def upsert_line_translations(rows: list):
+    table = LyricLineTranslation.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(translation=stmt.inserted.translation)
+    elif dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['line_hash'],
+            set_={'translation': stmt.excluded.translation}
+        )
+    else:
+        raise RuntimeError(f"Bulk upsert is not supported for the {dialect} dialect")
+    db.session.execute(stmt)
+
+def chunked(items: list, size: int) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def translate_words(pool, checkpoint: dict, args):
+    rows = db.session.query(CommonFrenchWord.id, CommonFrenchWord.word).filter(
+        CommonFrenchWord.translation.is_(None),
+        CommonFrenchWord.id > checkpoint['last_word_id']
+    ).order_by(CommonFrenchWord.id).all()
+    logger.info(f"{len(rows)} vocabulary words missing a translation")
+
+    batches = chunked(rows, args.batch_size)
+    texts = [[word for _, word in batch] for batch in batches]
+    for batch, translations in zip(batches, pool.map(translate_batch, texts, [args.language] * len(texts))):
+        db.session.execute(update(CommonFrenchWord), [
+            {'id': word_id, 'translation': translation[:255]}
+            for (word_id, _), translation in zip(batch, translations)
+        ])
+        db.session.commit()
+        checkpoint['last_word_id'] = batch[-1][0]
+        save_checkpoint(args.checkpoint, checkpoint)
+        logger.info(f"Translated words up to id {checkpoint['last_word_id']}")
+
+def most_common_lines(language: str, limit: int) -> list:
+    counts = Counter()
+    for (lyrics,) in db.session.query(TrackAnalysis.lyrics).filter(
+        TrackAnalysis.language == language,
+        TrackAnalysis.lyrics.isnot(None)
+    ).yield_per(500):
+        counts.update(line.strip() for line in lyrics.split('\n') if line.strip())
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [line for line, _ in ranked[:limit]]
+
+def translate_lines(pool, args):
+    # Lines already in the table are skipped, so the committed rows themselves
+    # are the checkpoint: the ranking is rebuilt from the current lyrics on resume
+    lines = most_common_lines(args.language, args.top_lines)
+    done = {
+        line_hash for (line_hash,) in db.session.query(LyricLineTranslation.line_hash)
+    }
+    pending = [line for line in lines if lyric_line_hash(line) not in done]
+    logger.info(f"{len(pending)} of the top {args.top_lines} lyric lines need translating")
+
+    translated = 0
+    batches = chunked(pending, args.batch_size)
+    for batch, translations in zip(batches, pool.map(translate_batch, batches, [args.language] * len(batches))):
+        upsert_line_translations([
+            {'line_hash': lyric_line_hash(line), 'line': line, 'translation': translation}
+            for line, translation in zip(batch, translations)
+        ])
+        db.session.commit()
+        translated += len(batch)
+        logger.info(f"Translated {translated} of {len(pending)} lyric lines")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--top-lines', type=int, default=5000)
+    parser.add_argument('--language', default='fr')
+    parser.add_argument('--checkpoint', default='pretranslate_checkpoint.json')
+    parser.add_argument('--skip-words', action='store_true')
+    parser.add_argument('--skip-lines', action='store_true')
+    args = parser.parse_args()
+    args.batch_size = max(1, min(args.batch_size, MAX_BATCH_SIZE))
+
+    checkpoint = load_checkpoint(args.checkpoint)
+    with app.app_context(), ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        try:
+            if not args.skip_words:
+                translate_words(pool, checkpoint, args)
+            if not args.skip_lines:
+                translate_lines(pool, args)
+        finally:
+            db.session.remove()
+
+    # A finished run starts from scratch next time, picking up newly added words
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    logger.info("Pretranslation finished")
+
+if __name__ == '__main__':
+    main()
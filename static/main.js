@@ -29,56 +29,62 @@ async function fetchRecentlyPlayed(accessToken) {
     return data.items;
 }
 
-async function fetchLyrics(artist, title) {
+async function streamTrackAnalysis(tracks, onResult) {
     try {
-        const apiUrl = `https://api.lyrics.ovh/v1/${encodeURIComponent(artist)}/${encodeURIComponent(title)}`;
-        const response = await fetch(`/proxy?url=${encodeURIComponent(apiUrl)}`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
-        return data.lyrics;
-    } catch (error) {
-        console.error('Error fetching lyrics:', error);
-        return null;
-    }
-}
-
-async function fetchCommonFrenchWords(lyrics) {
-    try {
-        const response = await fetch('/api/match-words', {
+        const response = await fetch('/api/analyze-tracks', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ lyrics }),
+            body: JSON.stringify({
+                tracks: tracks.map(item => ({
+                    artist: item.track.artists[0]?.name || '',
+                    title: item.track.name,
+                })),
+            }),
         });
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
         }
-        return await response.json();
+
+        // Results arrive as newline-delimited JSON, one track per line
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (line.trim()) onResult(JSON.parse(line));
+            }
+        }
+        if (buffer.trim()) onResult(JSON.parse(buffer));
+        return true;
     } catch (error) {
-        console.error('Error fetching common French words:', error);
-        return [];
+        console.error('Error analyzing tracks:', error);
+        return false;
     }
 }
 
-async function fetchContextForLyric(lyric) {
+async function fetchContextForLine(trackKey, lineId) {
     try {
         const response = await fetch('/api/generate-context', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ lyric }),
+            body: JSON.stringify({ track_key: trackKey, line_id: lineId }),
         });
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
         }
-        const data = await response.json();
-        return data.task_id;
+        // Either a precomputed context or a task ID to poll
+        return await response.json();
     } catch (error) {
         console.error('Error generating context:', error);
         throw error;
@@ -134,74 +140,88 @@ async function displayTracksAndWords(tracks, accessToken) {
     // Create loading indicator
     const loading = document.createElement('div');
     loading.className = 'loading';
-    loading.textContent = 'Detecting languages...';
+    loading.textContent = 'Analyzing tracks...';
     container.appendChild(loading);
 
     // Store processed tracks for later use
     const processedTracks = [];
 
-    // Process all tracks for language detection
-    for (const item of tracks) {
-        const track = item.track;
-        const songName = track.name;
-        const artistName = track.artists[0]?.name || '';
-
-        const lyrics = await fetchLyrics(artistName, songName);
-        // Remove the if(!lyrics) continue line to process all tracks
-        
-        let langData = { language: 'unknown', confidence: 0 };
-        
-        // Only detect language if lyrics are available
-        if (lyrics) {
-            try {
-                const langResponse = await fetch('/api/detect-language', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ text: lyrics })
-                });
-                
-                if (langResponse.ok) {
-                    langData = await langResponse.json();
-                }
-            } catch (error) {
-                console.error('Error detecting language:', error);
-            }
+    // Create a placeholder card per track so results can fill in as they stream back
+    const trackCards = tracks.map((item, index) => {
+        const songName = item.track.name;
+        const artistName = item.track.artists[0]?.name || '';
+
+        const trackCard = document.createElement('div');
+        trackCard.className = 'track-card';
+        trackCard.dataset.index = index;
+        trackCard.innerHTML = `
+            <label>
+                <input type="checkbox" class="track-checkbox" disabled>
+                <span class="track-name">${songName} - ${artistName}</span>
+                <span class="confidence">Analyzing...</span>
+            </label>
+        `;
+        selectionList.appendChild(trackCard);
+        return trackCard;
+    });
+    container.appendChild(selectionList);
+
+    // Lyrics, language detection and word matching all run server-side
+    const markTrackFailed = (trackCard) => {
+        trackCard.querySelector('.confidence').outerHTML =
+            '<span class="no-lyrics-badge">Analysis failed</span>';
+    };
+
+    const completed = await streamTrackAnalysis(tracks, (result) => {
+        // The server couldn't analyze this track (e.g. lyrics service unavailable)
+        if (result.error) {
+            markTrackFailed(trackCards[result.index]);
+            return;
         }
 
+        const item = tracks[result.index];
+        const songName = item.track.name;
+        const artistName = item.track.artists[0]?.name || '';
+        const hasLyrics = result.has_lyrics;
+
         // Store processed track data (even without lyrics)
-        processedTracks.push({
-            track,
+        processedTracks[result.index] = {
+            track: item.track,
             artistName,
             songName,
-            lyrics: lyrics || null,
-            language: langData.language,
-            confidence: langData.confidence
-        });
-
-        // Create track card
-        const trackCard = document.createElement('div');
-        trackCard.className = 'track-card';
-        trackCard.dataset.index = processedTracks.length - 1;
+            hasLyrics,
+            language: result.language,
+            confidence: result.confidence,
+            words: result.words || [],
+            trackKey: result.track_key,
+            contexts: result.contexts || {}
+        };
 
         // Add a visual indicator for tracks without lyrics
-        const languageDisplay = lyrics ? 
-            `<span class="language-badge ${langData.language}">${langData.language.toUpperCase()}</span>
-             <span class="confidence">(${Math.round(langData.confidence * 100)}%)</span>` : 
+        const languageDisplay = hasLyrics ? 
+            `<span class="language-badge ${result.language}">${result.language.toUpperCase()}</span>
+             <span class="confidence">(${Math.round(result.confidence * 100)}%)</span>` : 
             '<span class="no-lyrics-badge">No lyrics found</span>';
 
-        trackCard.innerHTML = `
+        trackCards[result.index].innerHTML = `
             <label>
                 <input type="checkbox" class="track-checkbox">
                 <span class="track-name">${songName} - ${artistName}</span>
                 ${languageDisplay}
             </label>
         `;
-        selectionList.appendChild(trackCard);
+    });
+
+    // Mark tracks the stream never delivered as failed
+    if (!completed) {
+        trackCards.forEach((trackCard, index) => {
+            if (processedTracks[index] || !trackCard.querySelector('.confidence')) return;
+            markTrackFailed(trackCard);
+        });
     }
 
-    // Remove loading indicator and add selection list
+    // Remove loading indicator
     loading.remove();
-    container.appendChild(selectionList);
 
     // Add button
     const addButton = document.createElement('button');
@@ -253,8 +273,9 @@ async function displayTracksAndWords(tracks, accessToken) {
             const trackCard = checkbox.closest('.track-card');
             const trackIndex = parseInt(trackCard.dataset.index);
             const trackData = processedTracks[trackIndex];
+            if (!trackData) continue;
 
-            if (!trackData.lyrics) {
+            if (!trackData.hasLyrics) {
                 // Create a row for tracks without lyrics
                 const row = document.createElement('tr');
                 row.innerHTML = `
@@ -265,8 +286,8 @@ async function displayTracksAndWords(tracks, accessToken) {
                 continue;
             }
 
-            // Get common words for this track
-            const commonWords = await fetchCommonFrenchWords(trackData.lyrics);
+            // Common words were matched during analysis
+            const commonWords = trackData.words;
 
             // If no common words found, still show the track
             if (commonWords.length === 0) {
@@ -283,6 +304,7 @@ async function displayTracksAndWords(tracks, accessToken) {
             for (const wordData of commonWords) {
                 const word = typeof wordData === 'object' ? wordData.word : wordData;
                 const translation = typeof wordData === 'object' ? (wordData.translation || 'N/A') : 'N/A';
+                const lineIds = typeof wordData === 'object' ? (wordData.lines || []) : [];
 
                 // Create row and append to tbody directly
                 const row = document.createElement('tr');
@@ -307,14 +329,17 @@ async function displayTracksAndWords(tracks, accessToken) {
                         generateContextBtn.disabled = true;
                         generateContextBtn.textContent = 'Generating...';
 
-                        // Find the lyric containing the common word
-                        const lyricWithWord = trackData.lyrics.split('\n').find(line =>
-                            line.toLowerCase().includes(word.toLowerCase())
-                        );
-
-                        if (lyricWithWord) {
-                            const taskId = await fetchContextForLyric(lyricWithWord);
-                            const context = await pollContextResult(taskId);
+                        // The server already picked the best lines containing the word
+                        const lineId = lineIds[0];
+
+                        if (lineId !== undefined) {
+                            // Reuse a context generated on a previous visit when there is one
+                            let context = trackData.contexts[lineId];
+                            if (!context) {
+                                const data = await fetchContextForLine(trackData.trackKey, lineId);
+                                context = data.status === 'completed' ? data.context : await pollContextResult(data.task_id);
+                                trackData.contexts[lineId] = context;
+                            }
                             contextContent.textContent = context;
                             contextContent.style.display = 'block';
                             generateContextBtn.style.display = 'none';
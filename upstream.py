@@ -0,0 +1,301 @@
+"""Resilient calls to upstream services (lyrics.ovh, Google Translate).
+
+Every dependency gets an Upstream with its own timeout, retry budget and
+circuit breaker. Retries back off exponentially with full jitter, an open
+breaker fails fast with CircuitOpenError instead of queueing more calls, and
+idempotent dependencies can send a hedged second request once the first has
+been outstanding longer than the observed p95 latency.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+upstreams = {}
+
+class UpstreamError(Exception):
+    """A retryable upstream failure, e.g. a 5xx or 429 response."""
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+class UpstreamBusy(UpstreamError):
+    """This process has no free slot for the dependency; rejected locally, not an upstream failure."""
+    def __init__(self, name: str):
+        super().__init__(f"No free slot for {name} calls")
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open")
+        self.retry_after = retry_after
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the given 0-based attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def raise_for_retryable_status(response):
+    if response.status_code == 429 or response.status_code >= 500:
+        raise UpstreamError(f"{response.url} returned {response.status_code}")
+    return response
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let a single trial call through; its outcome closes or reopens the circuit
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        with self.lock:
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release_trial(self):
+        """End a call that said nothing about the dependency's health.
+
+        A half-open trial goes back to open (with its original open time, so
+        the next call may trial again); a closed circuit is left as it was.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.OPEN:
+                # A late failure from a call started before the circuit opened
+                # must not extend the open window
+                return
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                logger.warning(f"Circuit opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class Upstream:
+    def __init__(self, name: str, timeout: float, max_retries: int = 2,
+                 backoff_base: float = 0.2, backoff_cap: float = 2.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 hedge: bool = False, hedge_min_samples: int = 20,
+                 max_workers: int = 16):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=500)
+        # Attempts run on this dependency's own pool, so a hung call can be
+        # abandoned at its timeout and a stuck dependency can't starve the others
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'upstream-{name}')
+        # One slot per pool thread: a call that can't get one is rejected
+        # locally instead of queueing behind abandoned attempts
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            'short_circuited': 0,
+            'rejected': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+        }
+        self.lock = threading.Lock()
+        upstreams[name] = self
+
+    def count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def p95(self):
+        with self.lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn with timeout, retries and circuit breaking.
+
+        fn should raise UpstreamError (or a network exception) for failures
+        worth retrying; any other exception is raised straight away.
+        """
+        return self.call_with_retries(self.max_retries, fn, *args, **kwargs)
+
+    def call_once(self, fn, *args, **kwargs):
+        """Like call() without retries, for callers that retry themselves (e.g. Celery tasks)."""
+        return self.call_with_retries(0, fn, *args, **kwargs)
+
+    def call_with_retries(self, max_retries: int, fn, *args, **kwargs):
+        for attempt in range(max_retries + 1):
+            if not self.breaker.allow():
+                self.count('short_circuited')
+                raise CircuitOpenError(self.name, self.breaker.retry_after())
+            if attempt:
+                self.count('retries')
+            self.count('requests')
+            try:
+                result = self.attempt(fn, *args, **kwargs)
+            except UpstreamBusy:
+                self.count('rejected')
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                if not self.is_retryable(e):
+                    self.breaker.release_trial()
+                    raise
+                self.count('failures')
+                self.breaker.record_failure()
+                if attempt == max_retries:
+                    raise
+                logger.warning(f"{self.name} call failed (attempt {attempt + 1}): {str(e)}")
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+            else:
+                self.breaker.record_success()
+                return result
+
+    def is_retryable(self, error: Exception) -> bool:
+        return isinstance(error, (
+            UpstreamError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            google_exceptions.ServerError,
+            google_exceptions.TooManyRequests,
+        ))
+
+    def submit(self, fn, args, kwargs):
+        """Start fn on the pool if a slot is free; returns (future, started event) or None."""
+        if not self.slots.acquire(blocking=False):
+            return None
+        started = threading.Event()
+
+        def run():
+            started.set()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.slots.release()
+
+        return self.executor.submit(run), started
+
+    def attempt(self, fn, *args, **kwargs):
+        submitted = self.submit(fn, args, kwargs)
+        if submitted is None:
+            raise UpstreamBusy(self.name)
+        first, started = submitted
+        futures = [first]
+        try:
+            # The timeout covers the upstream call, not time spent waiting for a thread
+            if not started.wait(self.timeout):
+                raise UpstreamBusy(self.name)
+            start = time.monotonic()
+            deadline = start + self.timeout
+            pending = {first}
+            hedge = None
+
+            hedge_delay = self.p95() if self.hedge else None
+            if hedge_delay is not None and hedge_delay < self.timeout:
+                done, _ = wait(pending, timeout=hedge_delay)
+                if not done:
+                    # Only hedge when a slot is free; otherwise keep waiting on the first call
+                    submitted = self.submit(fn, args, kwargs)
+                    if submitted is not None:
+                        self.count('hedged')
+                        hedge = submitted[0]
+                        futures.append(hedge)
+                        pending.add(hedge)
+
+            error = None
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        with self.lock:
+                            self.latencies.append(time.monotonic() - start)
+                        if future is hedge:
+                            self.count('hedge_wins')
+                        return future.result()
+                    error = future.exception()
+            if error is not None and not pending:
+                raise error
+            raise UpstreamTimeout(f"{self.name} call timed out after {self.timeout}s")
+        finally:
+            # Nobody will use the other attempts' results; drop any not yet running.
+            # Running ones finish (bounded by their transport timeout) and free their slot.
+            for future in futures:
+                if future.cancel():
+                    self.slots.release()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+        return {**counters, 'circuit_state': self.breaker.state, 'latency_p95': self.p95()}
+
+CIRCUIT_STATE_VALUES = {
+    CircuitBreaker.CLOSED: 0,
+    CircuitBreaker.HALF_OPEN: 1,
+    CircuitBreaker.OPEN: 2,
+}
+
+def metrics_snapshot() -> dict:
+    """Metrics for every upstream in this process, keyed by upstream name."""
+    return {name: upstream.metrics() for name, upstream in upstreams.items()}
+
+def render_metrics(processes: dict) -> str:
+    """Render metrics in the Prometheus text format.
+
+    processes maps a process label (e.g. "web:host:1234") to that process's
+    metrics_snapshot(); each process keeps its own breakers and counters.
+    """
+    series = [
+        (f'upstream="{name}",process="{process}"', snapshot)
+        for process, snapshots in sorted(processes.items())
+        for name, snapshot in sorted(snapshots.items())
+    ]
+    lines = [
+        '# HELP upstream_circuit_state Circuit breaker state (0=closed, 1=half open, 2=open).',
+        '# TYPE upstream_circuit_state gauge',
+    ]
+    for labels, snapshot in series:
+        lines.append(f'upstream_circuit_state{{{labels}}} {CIRCUIT_STATE_VALUES[snapshot["circuit_state"]]}')
+    for counter in ('requests', 'failures', 'retries', 'short_circuited', 'rejected', 'hedged', 'hedge_wins'):
+        lines.append(f'# TYPE upstream_{counter}_total counter')
+        for labels, snapshot in series:
+            lines.append(f'upstream_{counter}_total{{{labels}}} {snapshot[counter]}')
+    lines.append('# TYPE upstream_latency_p95_seconds gauge')
+    for labels, snapshot in series:
+        if snapshot['latency_p95'] is not None:
+            lines.append(f'upstream_latency_p95_seconds{{{labels}}} {snapshot["latency_p95"]:.6f}')
+    return '\n'.join(lines) + '\n'